@@ -1,29 +1,52 @@
 import sys
-import xml.etree.ElementTree as ET
 import re
-from ollama import chat, ChatResponse
-from bs4 import BeautifulSoup
+import asyncio
+from ollama import ChatResponse
+from llm_client import chat, achat_batch
 import logging
-from functools import wraps
-from typing import Dict, List, Optional, Callable, TypeVar, Any
+from io import BytesIO
+from typing import Dict, Iterator, List, Optional
+from dataclasses import dataclass
+
+try:
+    from lxml import etree as ET
+    _LXML = True
+except ImportError:
+    import xml.etree.ElementTree as ET
+    _LXML = False
 
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
-T = TypeVar('T')
+# Trace calls through log_decorator; when False it is a no-op
+DEBUG = False
+
+logger = logging.getLogger(__name__)
+
+_RE_CLEAN = re.compile(
+    r'(?P<fence>```(?:xml)?)|<author(?P<author>[^>]+)>|<genre\|(?P<genre>[^>]+)>')
+_RE_BOOKLIST = re.compile(r'<booklist>.*?</booklist>', re.DOTALL)
 
 
-def log_decorator(func: Callable[..., T]) -> Callable[..., T]:
-    @wraps(func)
-    def wrapper(*args: Any, **kwargs: Any) -> T:
-        logging.debug(f"Calling {func.__name__} with args: {
-                      args}, kwargs: {kwargs}")
-        result = func(*args, **kwargs)
-        logging.debug(f"{func.__name__} returned {result}")
-        return result
-    return wrapper
+if DEBUG:
+    def log_decorator(func):
+        def wrapper(*args, **kwargs):
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Calling %s", func.__name__)
+            result = func(*args, **kwargs)
+            # Skip string results: they are whole LLM/XML payloads
+            if logger.isEnabledFor(logging.DEBUG) and not isinstance(result, str):
+                logger.debug("%s returned %s", func.__name__, result)
+            return result
+        # Only the names are needed for the debug output
+        wrapper.__name__ = func.__name__
+        wrapper.__qualname__ = func.__qualname__
+        return wrapper
+else:
+    def log_decorator(func):
+        return func
 
 
 def get_element_text(elem: Optional[ET.Element], default: str = 'Unknown') -> str:
@@ -34,82 +57,119 @@ def get_element_text(elem: Optional[ET.Element], default: str = 'Unknown') -> st
             return elem.text or default
 
 
-def create_book_dict(book_elem: ET.Element) -> Dict[str, str]:
-    elements = ['title', 'author', 'publication_year', 'genre', 'isbn']
-    return {element: get_element_text(book_elem.find(element)) for element in elements}
+_BOOK_FIELDS = ('title', 'author', 'publication_year', 'genre', 'isbn')
+
+
+@dataclass(slots=True)
+class Book:
+    title: str
+    author: str
+    publication_year: str
+    genre: str
+    isbn: str
+
+
+def create_book(book_elem: ET.Element) -> Book:
+    # One pass over the children instead of a find() per field
+    elems = dict.fromkeys(_BOOK_FIELDS)
+    for child in book_elem:
+        if child.tag in elems and elems[child.tag] is None:
+            elems[child.tag] = child
+    return Book(**{field: get_element_text(elem) for field, elem in elems.items()})
+
+
+def books_to_soa(books: List[Book]) -> Dict[str, List[str]]:
+    return {field: [getattr(book, field) for book in books] for field in _BOOK_FIELDS}
 
 
 @log_decorator
-def parse_books_xml(xml_content: str) -> List[Dict[str, str]]:
-    root = ET.fromstring(xml_content)
-    return [create_book_dict(book) for book in root.findall('book')]
+def parse_books_xml(xml_content: str) -> Iterator[Book]:
+    source = BytesIO(xml_content.encode())
+    if _LXML:
+        for _, book in ET.iterparse(source, events=('end',), tag='book',
+                                    remove_blank_text=True):
+            # Like root.findall('book'): only direct children of the root
+            if book.getparent() is None or book.getparent().getparent() is not None:
+                continue
+            yield create_book(book)
+            # Free the finished book and the siblings parsed before it
+            book.clear()
+            while book.getprevious() is not None:
+                del book.getparent()[0]
+    else:
+        depth = 0
+        for event, elem in ET.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 1 and elem.tag == 'book':
+                yield create_book(elem)
+                elem.clear()
+
+
+def _clean_match(match: re.Match) -> str:
+    # Groups are named after the tag they rebuild
+    tag = match.lastgroup
+    if tag == 'fence':
+        return ''
+    return f"<{tag}>{match[tag]}</{tag}>"
 
 
 @log_decorator
 def clean_xml_content(xml_content: str) -> str:
-    transformations = [
-        (r'```xml|```', ''),
-        (r'<author([^>]+)>', r'<author>\1</author>'),
-        (r'<genre\|([^>]+)>', r'<genre>\1</genre>')
-    ]
-    return ''.join(
-        re.sub(pattern, repl, xml_content)
-        for pattern, repl in transformations
-    )
+    return _RE_CLEAN.sub(_clean_match, xml_content)
 
 
 @log_decorator
 def extract_xml_content(text: str) -> str:
-    match [text.find('<booklist>'), text.find('</booklist>')]:
-        case [-1, _] | [_, -1]:
-            raise ValueError("No valid XML content found")
-        case [start, end]:
-            xml_content = text[start:end + len('</booklist>')]
-            return BeautifulSoup(xml_content, "xml").prettify()
-
-
-def process_content(content: str, pipeline: List[Callable]) -> Any:
-    result = content
-    for func in pipeline:
-        result = func(result)
-    return result
+    booklist = _RE_BOOKLIST.search(text)
+    if booklist is None:
+        raise ValueError("No valid XML content found")
+    return booklist.group(0)
 
 
 @log_decorator
-def generate_books_xml() -> None:
+def generate_books_xml(questions: Optional[List[str]] = None) -> None:
 
-    question = 'a list of buddhist books'
-    response = get_xml_books(question)
+    questions = questions or ['a list of buddhist books']
+    responses = get_xml_books_batch(questions)
 
     try:
-        result = process_content(
-            response.message.content,
-            [clean_xml_content, extract_xml_content, parse_books_xml]
-        )
+        for response in responses:
+            result = parse_books_xml(
+                extract_xml_content(clean_xml_content(response.message.content))
+            )
 
-        [logging.debug(f"Book: {book}") for book in result]
+            for book in result:
+                logging.debug("Book: %s", book)
 
     except Exception as e:
         logging.error(f"Error occurred: {str(e)}")
         sys.exit(1)
 
 
-def get_xml_books(question) -> ChatResponse:
-    prompt = """
+BOOKS_PROMPT = """
     Generate an XML document that represents a list of books.
     Each book should contain the following elements: title, author, publication_year, genre, and ISBN.
     The root element should be <booklist>, and each book should be nested within a <book> tag.
     Ensure proper XML formatting and structure.
     """
 
-    messages = [
+
+def build_books_messages(question: str) -> List[Dict[str, str]]:
+    return [
         {'role': role, 'content': content}
         for role, content in [
-            ('system', prompt),
+            ('system', BOOKS_PROMPT),
             ('user', question)
         ]
     ]
 
+
+def get_xml_books(question) -> ChatResponse:
+    messages = build_books_messages(question)
+
     model = 'llama3.2:1b'
     try:
         response: ChatResponse = chat(model=model, messages=messages)
@@ -118,5 +178,16 @@ def get_xml_books(question) -> ChatResponse:
     return response
 
 
+async def get_xml_books_many(questions: List[str]) -> List[ChatResponse]:
+    return await achat_batch(
+        [build_books_messages(question) for question in questions],
+        model='llama3.2:1b'
+    )
+
+
+def get_xml_books_batch(questions: List[str]) -> List[ChatResponse]:
+    return asyncio.run(get_xml_books_many(questions))
+
+
 if __name__ == "__main__":
     generate_books_xml()
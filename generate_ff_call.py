@@ -1,30 +1,61 @@
 import sys
-import xml.etree.ElementTree as ET
 import re
-from ollama import chat, ChatResponse
-from bs4 import BeautifulSoup
+import ast
+import asyncio
+from ollama import ChatResponse
+from llm_client import chat, achat_batch
 import logging
-from functools import wraps
-from typing import Dict, List, Optional, Callable, TypeVar, Any
+from functools import lru_cache
+from io import BytesIO
+from operator import methodcaller
+from typing import Dict, Iterator, List, Optional, Callable, Tuple, Any
 from dataclasses import dataclass
 
+try:
+    from lxml import etree as ET
+    # A single parser instance is reused for every document we parse
+    _XML_PARSER = ET.XMLParser(remove_blank_text=True, huge_tree=False)
+    _find_parameters = ET.XPath('./Input/Parameter')
+    _LXML = True
+except ImportError:
+    import xml.etree.ElementTree as ET
+    _XML_PARSER = None
+    _find_parameters = methodcaller('findall', './Input/Parameter')
+    _LXML = False
+
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
-T = TypeVar('T')
+# Trace calls through log_decorator; when False it is a no-op
+DEBUG = False
 
+logger = logging.getLogger(__name__)
+
+_RE_CLEAN = re.compile(
+    r'(?P<fence>```(?:xml)?)|<author(?P<author>[^>]+)>|<genre\|(?P<genre>[^>]+)>')
+_RE_BOOKLIST = re.compile(r'<booklist>.*?</booklist>', re.DOTALL)
+_RE_CALL = re.compile(r'^.*?([A-Za-z_][A-Za-z0-9_]*\(.*\)).*?$', re.DOTALL)
 
-def log_decorator(func: Callable[..., T]) -> Callable[..., T]:
-    @wraps(func)
-    def wrapper(*args: Any, **kwargs: Any) -> T:
-        logging.debug(f"Calling {func.__name__} with args: {
-                      args}, kwargs: {kwargs}")
-        result = func(*args, **kwargs)
-        logging.debug(f"{func.__name__} returned {result}")
-        return result
-    return wrapper
+
+if DEBUG:
+    def log_decorator(func):
+        def wrapper(*args, **kwargs):
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Calling %s", func.__name__)
+            result = func(*args, **kwargs)
+            # Skip string results: they are whole LLM/XML payloads
+            if logger.isEnabledFor(logging.DEBUG) and not isinstance(result, str):
+                logger.debug("%s returned %s", func.__name__, result)
+            return result
+        # Only the names are needed for the debug output
+        wrapper.__name__ = func.__name__
+        wrapper.__qualname__ = func.__qualname__
+        return wrapper
+else:
+    def log_decorator(func):
+        return func
 
 
 def get_element_text(elem: Optional[ET.Element], default: str = 'Unknown') -> str:
@@ -35,45 +66,76 @@ def get_element_text(elem: Optional[ET.Element], default: str = 'Unknown') -> st
             return elem.text or default
 
 
-def create_book_dict(book_elem: ET.Element) -> Dict[str, str]:
-    elements = ['title', 'author', 'publication_year', 'genre', 'isbn']
-    return {element: get_element_text(book_elem.find(element)) for element in elements}
+_BOOK_FIELDS = ('title', 'author', 'publication_year', 'genre', 'isbn')
+
+
+@dataclass(slots=True)
+class Book:
+    title: str
+    author: str
+    publication_year: str
+    genre: str
+    isbn: str
+
+
+def create_book(book_elem: ET.Element) -> Book:
+    # One pass over the children instead of a find() per field
+    elems = dict.fromkeys(_BOOK_FIELDS)
+    for child in book_elem:
+        if child.tag in elems and elems[child.tag] is None:
+            elems[child.tag] = child
+    return Book(**{field: get_element_text(elem) for field, elem in elems.items()})
+
+
+def books_to_soa(books: List[Book]) -> Dict[str, List[str]]:
+    return {field: [getattr(book, field) for book in books] for field in _BOOK_FIELDS}
 
 
 @log_decorator
-def parse_books_xml(xml_content: str) -> List[Dict[str, str]]:
-    root = ET.fromstring(xml_content)
-    return [create_book_dict(book) for book in root.findall('book')]
+def parse_books_xml(xml_content: str) -> Iterator[Book]:
+    source = BytesIO(xml_content.encode())
+    if _LXML:
+        for _, book in ET.iterparse(source, events=('end',), tag='book',
+                                    remove_blank_text=True):
+            # Like root.findall('book'): only direct children of the root
+            if book.getparent() is None or book.getparent().getparent() is not None:
+                continue
+            yield create_book(book)
+            # Free the finished book and the siblings parsed before it
+            book.clear()
+            while book.getprevious() is not None:
+                del book.getparent()[0]
+    else:
+        depth = 0
+        for event, elem in ET.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 1 and elem.tag == 'book':
+                yield create_book(elem)
+                elem.clear()
+
+
+def _clean_match(match: re.Match) -> str:
+    # Groups are named after the tag they rebuild
+    tag = match.lastgroup
+    if tag == 'fence':
+        return ''
+    return f"<{tag}>{match[tag]}</{tag}>"
 
 
 @log_decorator
 def clean_xml_content(xml_content: str) -> str:
-    transformations = [
-        (r'```xml|```', ''),
-        (r'<author([^>]+)>', r'<author>\1</author>'),
-        (r'<genre\|([^>]+)>', r'<genre>\1</genre>')
-    ]
-    return ''.join(
-        re.sub(pattern, repl, xml_content)
-        for pattern, repl in transformations
-    )
+    return _RE_CLEAN.sub(_clean_match, xml_content)
 
 
 @log_decorator
 def extract_xml_content(text: str) -> str:
-    match [text.find('<booklist>'), text.find('</booklist>')]:
-        case [-1, _] | [_, -1]:
-            raise ValueError("No valid XML content found")
-        case [start, end]:
-            xml_content = text[start:end + len('</booklist>')]
-            return BeautifulSoup(xml_content, "xml").prettify()
-
-
-def process_content(content: str, pipeline: List[Callable]) -> Any:
-    result = content
-    for func in pipeline:
-        result = func(result)
-    return result
+    booklist = _RE_BOOKLIST.search(text)
+    if booklist is None:
+        raise ValueError("No valid XML content found")
+    return booklist.group(0)
 
 
 @log_decorator
@@ -83,12 +145,12 @@ def generate_books_xml() -> None:
     response = get_xml_books(question)
 
     try:
-        result = process_content(
-            response.message.content,
-            [clean_xml_content, extract_xml_content, parse_books_xml]
+        result = parse_books_xml(
+            extract_xml_content(clean_xml_content(response.message.content))
         )
 
-        [logging.debug(f"Book: {book}") for book in result]
+        for book in result:
+            logging.debug("Book: %s", book)
 
     except Exception as e:
         logging.error(f"Error occurred: {str(e)}")
@@ -119,42 +181,49 @@ def get_xml_books(question) -> ChatResponse:
     return response
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Parameter:
     name: str
     type: str
     value: Any = None
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Function:
     name: str
-    parameters: List[Parameter]
+    parameters: Tuple[Parameter, ...]
 
 def parse_function_def(xml_content: str) -> Function:
     """Parse XML function definition into a Function object"""
-    root = ET.fromstring(xml_content)
+    root = ET.fromstring(xml_content.encode(), _XML_PARSER)
     name = root.get('name')
     params = []
     
-    for param in root.findall('./Input/Parameter'):
+    for param in _find_parameters(root):
         param_value = Parameter(
             name=param.get('name'),
             type=param.get('type'),
             value=param.text if param.text else None
         )
-        logging.debug(f"Parsed parameter: {param_value}")
+        logging.debug("Parsed parameter: %s", param_value)
         params.append(param_value)
     
-    return Function(name=name, parameters=params)
+    return Function(name=name, parameters=tuple(params))
+
+_TYPE_CONVERTERS: Dict[str, Callable[[str], Any]] = {
+    'int': int,
+    'float': float,
+    'str': str,
+    'bool': lambda x: x.lower() == 'true'
+}
 
 def generate_function_call(func: Function) -> Dict[str, Any]:
     """Generate function call parameters from Function object"""
     params = {
-        param.name: convert_type(param.value, param.type) 
+        param.name: convert_type(param.value, param.type)
         for param in func.parameters
         if param.value is not None
     }
-    logging.debug(f"Generated parameters for {func.name}: {params}")
+    logging.debug("Generated parameters for %s: %s", func.name, params)
     return params
 
 def convert_type(value: str, type_name: str) -> Any:
@@ -162,24 +231,51 @@ def convert_type(value: str, type_name: str) -> Any:
     if value is None:
         return None
     
-    type_converters = {
-        'int': int,
-        'float': float,
-        'str': str,
-        'bool': lambda x: x.lower() == 'true'
-    }
-    
-    converter = type_converters.get(type_name)
-    if not converter:
+    converter = _TYPE_CONVERTERS.get(type_name)
+    if converter is None:
         raise ValueError(f"Unsupported type: {type_name}")
+    return converter(value)
+
+def build_function_call(func: Function) -> str:
+    """Build the call string for a Function locally, without the LLM"""
+    if not func.name or any(not param.name for param in func.parameters):
+        raise ValueError(f"Function or parameter without a name: {func}")
+    params = generate_function_call(func)
+    args = ', '.join(f"{name}={value!r}" for name, value in params.items())
+    call_string = f"{func.name}({args})"
+    
+    # repr() is not always a literal (inf, nan) and names may not be identifiers
+    try:
+        parse_call_string(call_string)
+    except (SyntaxError, ValueError, TypeError) as e:
+        raise ValueError(f"Cannot render a valid call for {func.name}: {call_string}") from e
+    return call_string
+
+@lru_cache(maxsize=256)
+def get_function_call(xml_definition: str) -> str:
+    """Turn an XML function definition into a call string deterministically"""
+    return build_function_call(parse_function_def(xml_definition))
+
+def get_function_calls(xml_definitions: List[str]) -> List[str]:
+    """Synthesize call strings locally, asking the LLM only for the rest"""
+    call_strings: List[Optional[str]] = []
+    unresolved = []
+    for xml_definition in xml_definitions:
+        try:
+            call_strings.append(get_function_call(xml_definition))
+        except (SyntaxError, ValueError) as e:
+            # Malformed XML or unsupported types: leave it to the LLM
+            logging.debug("Falling back to LLM for definition: %s", e)
+            call_strings.append(None)
+            unresolved.append(xml_definition)
     
-    result = converter(value)
-    logging.debug(f"Converted value '{value}' to type {type_name}: {result}")
-    return result
+    if unresolved:
+        llm_call_strings = iter(get_llm_function_calls(unresolved))
+        call_strings = [call_string if call_string is not None else next(llm_call_strings)
+                        for call_string in call_strings]
+    return call_strings
 
-def get_llm_function_call(xml_definition: str) -> str:
-    """Ask LLM to generate a function call based on XML definition"""
-    prompt = """
+FUNCTION_CALL_PROMPT = """
     Given this XML function definition, return ONLY a valid Python function call string, nothing else.
     Maintain the exact function name case from the XML.
     DO NOT include any explanation text or backticks.
@@ -194,43 +290,90 @@ def get_llm_function_call(xml_definition: str) -> str:
     You should return exactly and only:
     CalculateSum(x=5, y=3)
     """
-    
-    messages = [
-        {'role': 'system', 'content': prompt},
+
+def build_function_call_messages(xml_definition: str) -> List[Dict[str, str]]:
+    """Build the chat messages asking the LLM for a function call"""
+    return [
+        {'role': 'system', 'content': FUNCTION_CALL_PROMPT},
         {'role': 'user', 'content': xml_definition}
     ]
+
+def extract_call_string(response: ChatResponse) -> str:
+    """Extract the bare function call string from an LLM response"""
+    # Clean the response to get just the function call
+    call_string = response.message.content.strip()
+    logging.debug("LLM generated function call: %s", call_string)
+    # Remove any markdown backticks and extra text
+    return _RE_CALL.sub(r'\1', call_string)
+
+def get_llm_function_call(xml_definition: str) -> str:
+    """Ask LLM to generate a function call based on XML definition"""
+    messages = build_function_call_messages(xml_definition)
     
     try:
         response: ChatResponse = chat(model='llama3.2:1b', messages=messages)
-        # Clean the response to get just the function call
-        call_string = response.message.content.strip()
-        logging.debug(f"LLM generated function call: {call_string}")
-        # Remove any markdown backticks and extra text
-        call_string = re.sub(r'^.*?([A-Za-z_][A-Za-z0-9_]*\(.*\)).*?$', r'\1', call_string, flags=re.DOTALL)
-        return call_string
+        return extract_call_string(response)
     except Exception as e:
         logging.error(f"LLM error: {e}")
         raise
 
+async def get_llm_function_calls_many(xml_definitions: List[str]) -> List[str]:
+    """Ask LLM for the function calls of several XML definitions concurrently"""
+    try:
+        responses = await achat_batch(
+            [build_function_call_messages(xml_definition)
+             for xml_definition in xml_definitions],
+            model='llama3.2:1b'
+        )
+    except Exception as e:
+        logging.error(f"LLM error: {e}")
+        raise
+    return [extract_call_string(response) for response in responses]
+
+def get_llm_function_calls(xml_definitions: List[str]) -> List[str]:
+    """Synchronous wrapper around get_llm_function_calls_many"""
+    return asyncio.run(get_llm_function_calls_many(xml_definitions))
+
+@lru_cache(maxsize=256)
+def _parse_call_node(call_string: str) -> ast.Call:
+    """Parse and validate a call string, caching only the AST"""
+    node = ast.parse(call_string.strip(), mode='eval').body
+    if not isinstance(node, ast.Call) or not isinstance(node.func, ast.Name):
+        raise ValueError(f"Not a plain function call: {call_string}")
+    if any(keyword.arg is None for keyword in node.keywords):
+        raise ValueError(f"Keyword unpacking is not allowed: {call_string}")
+    return node
+
+def parse_call_string(call_string: str) -> Tuple[str, Tuple[Any, ...], Dict[str, Any]]:
+    """Parse a call string into its function name and literal arguments"""
+    node = _parse_call_node(call_string)
+    # literal_eval only accepts literals, so nothing in the string gets executed;
+    # it runs on every call so mutable arguments are never shared between calls
+    args = tuple(ast.literal_eval(arg) for arg in node.args)
+    kwargs = {keyword.arg: ast.literal_eval(keyword.value)
+              for keyword in node.keywords}
+    return node.func.id, args, kwargs
+
 def execute_function_call(call_string: str, available_functions: Dict[str, callable]) -> Any:
     """Execute a function call string with the given available functions"""
-    # Extract function name from call string
-    func_name = call_string.split('(')[0].strip()
+    try:
+        func_name, args, kwargs = parse_call_string(call_string)
+    except (SyntaxError, ValueError, TypeError) as e:
+        logging.error(f"Invalid function call: {e}")
+        raise ValueError(f"Invalid function call: {call_string}") from e
     
     if func_name not in available_functions:
         raise ValueError(f"Function {func_name} not found in available functions")
     
     # Execute the function call
     try:
-        result = eval(call_string, {"__builtins__": {}}, available_functions)
+        result = available_functions[func_name](*args, **kwargs)
         return result
     except Exception as e:
         logging.error(f"Error executing function: {e}")
         raise
 
-def example_usage():
-    # Example function definition
-    xml = '''
+EXAMPLE_FUNCTION_XML = '''
     <Function name="CalculateSum">
         <Input>
             <Parameter name="a" type="int">5</Parameter>
@@ -238,6 +381,10 @@ def example_usage():
         </Input>
     </Function>
     '''
+
+def example_usage(xml_definitions: Optional[List[str]] = None):
+    # Example function definitions
+    xml_definitions = xml_definitions or [EXAMPLE_FUNCTION_XML]
     
     # Define available functions
     def calculate_sum(a: int, b: int) -> int:
@@ -247,20 +394,25 @@ def example_usage():
         'CalculateSum': calculate_sum
     }
     
-    logging.info("Processing function definition")
-    logging.debug(f"Input XML:\n{xml}")
+    logging.info(f"Processing {len(xml_definitions)} function definitions")
+    for xml in xml_definitions:
+        logging.debug("Input XML:\n%s", xml)
     
     try:
-        # Get function call from LLM
-        call_string = get_llm_function_call(xml)
-        logging.info(f"LLM generated function call: {call_string}")
-        
-        # Execute the function
-        result = execute_function_call(call_string, available_functions)
-        logging.info(f"Function result: {result}")
-        
+        # Build the function calls locally, with one LLM batch for the rest
+        call_strings = get_function_calls(xml_definitions)
     except Exception as e:
         logging.error(f"Error: {e}")
+        return
+    
+    for call_string in call_strings:
+        logging.info(f"Generated function call: {call_string}")
+        try:
+            # Execute the function
+            result = execute_function_call(call_string, available_functions)
+            logging.info(f"Function result: {result}")
+        except Exception as e:
+            logging.error(f"Error: {e}")
 
 if __name__ == "__main__":
     example_usage()
@@ -0,0 +1,226 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import httpx
+from ollama import Client, AsyncClient, ChatResponse, Message
+
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+try:
+    import orjson
+
+    def _dumps_sorted(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+except ImportError:
+    try:
+        import msgspec
+
+        _msgspec_encoder = msgspec.json.Encoder(order='sorted')
+
+        def _dumps_sorted(obj) -> bytes:
+            return _msgspec_encoder.encode(obj)
+    except ImportError:
+        def _dumps_sorted(obj) -> bytes:
+            return json.dumps(obj, sort_keys=True).encode()
+
+
+CACHE_SIZE = 1024
+CACHE_DIR = '.llm_cache'
+CACHE_EXPIRE = 3600
+BATCH_SIZE = 32
+
+# 'ollama' (default) or 'llamacpp' for a llama.cpp llama-server
+LLM_BACKEND = os.environ.get('LLM_BACKEND', 'ollama')
+LLAMACPP_URL = os.environ.get('LLAMACPP_URL', 'http://localhost:8080')
+
+# Shared by every HTTP client so connections are kept alive and reused.
+# Reads stay unbounded: cold model loads and long generations take a while
+HTTP_TIMEOUT = httpx.Timeout(60.0, read=None)
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=16)
+
+_memory_cache: 'OrderedDict[str, ChatResponse]' = OrderedDict()
+_disk_cache = None
+
+
+def to_chat_response(data: Dict) -> ChatResponse:
+    """Convert an OpenAI-style completion into an ollama ChatResponse"""
+    message = data['choices'][0]['message']
+    return ChatResponse(
+        model=data.get('model', ''),
+        message=Message(role=message['role'], content=message['content'])
+    )
+
+
+class LlamaCppClient:
+    """Client for llama-server's OpenAI-compatible chat endpoint"""
+
+    def __init__(self, base_url: str = LLAMACPP_URL,
+                 timeout: httpx.Timeout = HTTP_TIMEOUT):
+        self._http = httpx.Client(base_url=base_url, timeout=timeout,
+                                  limits=HTTP_LIMITS)
+
+    def chat(self, model: str, messages: List[Dict[str, str]]) -> ChatResponse:
+        response = self._http.post('/v1/chat/completions',
+                                   json={'model': model, 'messages': messages})
+        response.raise_for_status()
+        return to_chat_response(response.json())
+
+
+class AsyncLlamaCppClient:
+    """Async counterpart of LlamaCppClient"""
+
+    def __init__(self, base_url: str = LLAMACPP_URL,
+                 timeout: httpx.Timeout = HTTP_TIMEOUT):
+        self._http = httpx.AsyncClient(base_url=base_url, timeout=timeout,
+                                       limits=HTTP_LIMITS)
+
+    async def chat(self, model: str, messages: List[Dict[str, str]]) -> ChatResponse:
+        response = await self._http.post('/v1/chat/completions',
+                                         json={'model': model, 'messages': messages})
+        response.raise_for_status()
+        return to_chat_response(response.json())
+
+    async def aclose(self) -> None:
+        await self._http.aclose()
+
+
+def new_client():
+    """Synchronous chat client for the configured backend"""
+    if LLM_BACKEND == 'llamacpp':
+        return LlamaCppClient()
+    # ollama's clients forward extra keyword arguments to httpx
+    return Client(timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS)
+
+
+def new_async_client():
+    """Asynchronous chat client for the configured backend"""
+    if LLM_BACKEND == 'llamacpp':
+        return AsyncLlamaCppClient()
+    return AsyncClient(timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS)
+
+
+async def close_async_client(client) -> None:
+    """Close the httpx pool behind a client from new_async_client"""
+    if isinstance(client, AsyncLlamaCppClient):
+        await client.aclose()
+    else:
+        await client._client.aclose()
+
+
+# Module-wide client: every synchronous chat reuses its connection pool
+_client = new_client()
+
+
+def normalize_messages(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """Keep only the fields that affect the answer, with trimmed content"""
+    return [
+        {'role': message['role'], 'content': message['content'].strip()}
+        for message in messages
+    ]
+
+
+def cache_key(model: str, messages: List[Dict[str, str]]) -> str:
+    """Digest identifying a chat request"""
+    payload = _dumps_sorted({
+        'backend': LLM_BACKEND,
+        'model': model,
+        'messages': normalize_messages(messages)
+    })
+    return hashlib.sha256(payload).hexdigest()
+
+
+def get_disk_cache():
+    """Open the persistent cache on first use, if diskcache is installed"""
+    global _disk_cache
+    if _disk_cache is None and diskcache is not None:
+        _disk_cache = diskcache.Cache(CACHE_DIR)
+    return _disk_cache
+
+
+def get_cached(key: str) -> Optional[ChatResponse]:
+    """Look a response up in memory first, then on disk"""
+    if key in _memory_cache:
+        _memory_cache.move_to_end(key)
+        return _memory_cache[key]
+
+    disk_cache = get_disk_cache()
+    if disk_cache is None:
+        return None
+    response = disk_cache.get(key)
+    if response is not None:
+        remember(key, response)
+    return response
+
+
+def remember(key: str, response: ChatResponse) -> None:
+    """Store a response in the in-memory LRU cache"""
+    _memory_cache[key] = response
+    _memory_cache.move_to_end(key)
+    if len(_memory_cache) > CACHE_SIZE:
+        _memory_cache.popitem(last=False)
+
+
+def set_cached(key: str, response: ChatResponse) -> None:
+    """Store a response in memory and, when available, on disk"""
+    remember(key, response)
+    disk_cache = get_disk_cache()
+    if disk_cache is not None:
+        disk_cache.set(key, response, expire=CACHE_EXPIRE)
+
+
+def chat(model: str, messages: List[Dict[str, str]]) -> ChatResponse:
+    """Chat with the configured backend, with a response cache in front of it"""
+    key = cache_key(model, messages)
+    response = get_cached(key)
+    if response is not None:
+        logging.debug("LLM cache hit for %s: %s", model, key)
+        return response
+
+    response = _client.chat(model=model, messages=messages)
+    set_cached(key, response)
+    return response
+
+
+async def achat(client, model: str,
+                messages: List[Dict[str, str]]) -> ChatResponse:
+    """Async client chat with the same response cache as chat"""
+    key = cache_key(model, messages)
+    response = get_cached(key)
+    if response is not None:
+        logging.debug("LLM cache hit for %s: %s", model, key)
+        return response
+
+    response = await client.chat(model=model, messages=messages)
+    set_cached(key, response)
+    return response
+
+
+async def achat_batch(messages_list: List[List[Dict[str, str]]],
+                      model: str) -> List[ChatResponse]:
+    """Run several chat requests concurrently, BATCH_SIZE at a time"""
+    # An async pool is bound to its event loop, so each batch run gets one
+    client = new_async_client()
+    responses: List[ChatResponse] = []
+    try:
+        for start in range(0, len(messages_list), BATCH_SIZE):
+            batch = messages_list[start:start + BATCH_SIZE]
+            responses.extend(await asyncio.gather(*[
+                achat(client, model=model, messages=messages)
+                for messages in batch
+            ]))
+    finally:
+        await close_async_client(client)
+    return responses
+
+
+def chat_batch(messages_list: List[List[Dict[str, str]]],
+               model: str) -> List[ChatResponse]:
+    """Synchronous wrapper around achat_batch"""
+    return asyncio.run(achat_batch(messages_list, model))